@@ -1,97 +1,207 @@
+import io
 import os
+import re
+import functools
 import shutil
 import zipfile
-import tempfile
-import xml.etree.ElementTree as ET
-import glob
+try:
+    # lxml ships with QGIS and parses/serializes in C
+    from lxml import etree as ET
+    # Let lxml pick out the <maplayer> elements in C while parsing, and lift its 10 MB
+    # text node limit, which embedded base64 images in projects can exceed
+    ITERPARSE_OPTIONS = {'tag': 'maplayer', 'huge_tree': True}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    ITERPARSE_OPTIONS = {}
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from qgis.core import QgsProject
 
+# With lxml, the per-layer lookups are XPath expressions compiled once and run in libxml2
+if hasattr(ET, 'XPath'):
+    PROVIDER_XP = ET.XPath('string(provider)')
+    DATASOURCE_XP = ET.XPath('datasource')
+    LAYERNAME_XP = ET.XPath('string(layername)')
+else:
+    PROVIDER_XP = DATASOURCE_XP = LAYERNAME_XP = None
+
+# --- Settings ---
+# The ZIP is written straight from the source files; set this to True to also
+# keep an unzipped copy of the package next to it
+KEEP_PACKAGE_FOLDER = False
+
+# Parent folders too generic to keep as Links/<parent>/ in the package
+SYSTEM_FOLDERS = frozenset({'Documents', 'Desktop', 'Downloads', 'Users', 'home', 'tmp', 'temp', 'Program Files', 'Windows', 'System32'})
+
+# Files that make up a shapefile and are copied alongside the .shp
+SHAPEFILE_EXTENSIONS = ('.shp', '.dbf', '.shx', '.prj', '.cpg', '.qix', '.sbn', '.sbx', '.shp.xml', '.fix', '.qpj')
+
+# Already-compressed formats are stored as-is in the package ZIP; the rest is deflated
+STORED_EXTENSIONS = frozenset({'.zip', '.qgz', '.gz', '.7z', '.png', '.jpg', '.jpeg', '.jp2', '.ecw', '.sid', '.webp', '.laz'})
+ZIP_COMPRESSLEVEL = 3
+
+# Leading ./, ../ and / segments stripped from a datasource before retrying it under each search root
+RELATIVE_PREFIX_RE = re.compile(r'^(?:\.\.?/|/)+')
+
 # --- Helper functions ---
-def find_file_aggressively(filename, search_roots):
-    """Search for a file in multiple root directories recursively"""
+# Filename -> paths for the search roots walked so far, innermost first
+_file_index = {}
+_indexed_roots = []
+index_skip_dirs = set()
+
+@functools.lru_cache(maxsize=None)
+def _isfile_cached(path):
+    """os.path.isfile, memoized since many layers point at the same candidate paths"""
+    return os.path.isfile(path)
+
+def _walk(root, skip_dirs):
+    """Yield (name, path) for every file under root using one scandir batch per directory"""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        if current in skip_dirs:
+            continue
+        try:
+            with os.scandir(current) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # Like the recursive glob, don't descend into hidden directories
+                        if not entry.name.startswith('.'):
+                            subdirs.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.name, entry.path
+        except OSError:
+            continue
+        # Reversed so directories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+def extend_file_index(root):
+    """Add the files under root to the index, skipping the subtrees of roots already walked"""
+    root = os.path.realpath(root)
+    if root in _indexed_roots:
+        return
+    skip_dirs = set(map(os.path.realpath, index_skip_dirs)) | set(_indexed_roots)
+    if os.path.isdir(root):
+        for name, path in _walk(root, skip_dirs):
+            _file_index.setdefault(name, []).append(path)
+    _indexed_roots.append(root)
+
+def find_indexed(filename, search_roots, suffix=''):
+    """Return the indexed path for a filename under the earliest search root, or None"""
+    # Roots are nested, so a path ranks by the first root it falls under; min keeps walk order on ties
+    prefixes = [os.path.join(os.path.realpath(root), '') for root in search_roots]
+    def root_rank(path):
+        return next((i for i, prefix in enumerate(prefixes) if path.startswith(prefix)), len(prefixes))
+    
+    # Each directory is walked at most once per run; outer roots are only walked on a miss
     for root in search_roots:
-        if os.path.exists(root):
-            for path in glob.glob(os.path.join(root, '**', filename), recursive=True):
-                if os.path.isfile(path):
-                    return path
+        extend_file_index(root)
+        candidates = [p for p in _file_index.get(filename, ()) if p.endswith(suffix)]
+        if candidates:
+            return min(candidates, key=root_rank)
     return None
 
+def find_file_aggressively(filename, search_roots):
+    """Look up a file by name in the index of the search roots"""
+    return find_indexed(filename, search_roots)
+
 def find_zip_aggressively(zip_name, search_roots):
-    """Search for a ZIP file in multiple root directories recursively"""
-    for root in search_roots:
-        if os.path.exists(root):
-            for path in glob.glob(os.path.join(root, '**', zip_name), recursive=True):
-                if os.path.isfile(path) and path.endswith('.zip'):
-                    return path
-    return None
+    """Look up a ZIP file by name in the index of the search roots"""
+    return find_indexed(zip_name, search_roots, suffix='.zip')
+
+def read_maplayer(maplayer):
+    """Return the provider, <datasource> element (or None) and name of a <maplayer>"""
+    if DATASOURCE_XP is not None:
+        datasource_elems = DATASOURCE_XP(maplayer)
+        datasource_elem = datasource_elems[0] if datasource_elems else None
+        return PROVIDER_XP(maplayer), datasource_elem, LAYERNAME_XP(maplayer)
+    return maplayer.findtext('provider'), maplayer.find('datasource'), maplayer.findtext('layername')
 
+@functools.lru_cache(maxsize=4096)
 def parse_vsizip_path(vsizip_path):
     """Parse /vsizip/ path to get ZIP file and internal path"""
     if not vsizip_path.startswith('/vsizip/'):
         return None, None
     
-    # Remove /vsizip/ prefix
-    path = vsizip_path[8:]
-    
-    # Handle |layername= syntax
-    if '|' in path:
-        path = path.split('|')[0]
+    # Remove /vsizip/ prefix and handle |layername= syntax
+    path = vsizip_path[8:].partition('|')[0]
     
     # Find .zip in the path
-    if '.zip' in path:
-        parts = path.split('.zip', 1)
-        zip_path = parts[0] + '.zip'
-        inner_path = parts[1].lstrip('/') if len(parts) > 1 else ''
-        return zip_path, inner_path
+    head, sep, tail = path.partition('.zip')
+    if sep:
+        return head + '.zip', tail.lstrip('/')
     
     return None, None
 
-def resolve_path_aggressively(datasource, project_folder):
+def resolve_path_aggressively(datasource, project_folder, search_roots):
     """Try multiple strategies to find a file"""
     # Handle |layername= syntax
-    if '|' in datasource:
-        datasource = datasource.split('|')[0]
-    
+    datasource = datasource.partition('|')[0]
+    return _resolve_path_cached(datasource, project_folder, search_roots)
+
+@functools.lru_cache(maxsize=None)
+def _resolve_path_cached(datasource, project_folder, search_roots):
+    """Resolve a datasource stripped of its |options; layers often share the same source"""
     # Direct absolute path
-    if os.path.isabs(datasource) and os.path.isfile(datasource):
+    if os.path.isabs(datasource) and _isfile_cached(datasource):
         return datasource
     
     # Relative to project folder
     resolved = os.path.normpath(os.path.join(project_folder, datasource))
-    if os.path.isfile(resolved):
+    if _isfile_cached(resolved):
         return resolved
     
     # Search in common parent directories
-    search_roots = [
-        project_folder,
-        os.path.dirname(project_folder),
-        os.path.dirname(os.path.dirname(project_folder)),
-        os.path.dirname(os.path.dirname(os.path.dirname(project_folder))),
-    ]
-    
     filename = os.path.basename(datasource)
     found = find_file_aggressively(filename, search_roots)
     if found:
         return found
     
     # Try removing ./ or ../ prefixes and search
-    clean_path = datasource.lstrip('./').lstrip('../')
+    clean_path = RELATIVE_PREFIX_RE.sub('', datasource)
     for root in search_roots:
         candidate = os.path.join(root, clean_path)
-        if os.path.isfile(candidate):
+        if _isfile_cached(candidate):
             return candidate
     
     return None
 
+# A resolved layer source: the file to package, its kind ('zip', 'shapefile' or 'file') and
+# the text around the package-relative path in the rewritten datasource
+Plan = namedtuple('Plan', 'src kind prefix suffix')
+
+def plan_layer(datasource, project_folder, search_roots):
+    """Resolve a layer datasource into a Plan, or return None and the reason it is skipped"""
+    _, sep, options = datasource.partition('|')
+    suffix = sep + options
+    
+    # Handle /vsizip/ paths - package the entire ZIP file
+    if datasource.startswith('/vsizip/'):
+        zip_path, inner_path = parse_vsizip_path(datasource)
+        if not zip_path:
+            return None, f"Invalid vsizip path: {datasource}"
+        resolved_zip = resolve_path_aggressively(zip_path, project_folder, search_roots)
+        if not resolved_zip:
+            return None, f"ZIP file not found: {zip_path}"
+        if inner_path:
+            suffix = f"/{inner_path}" + suffix
+        return Plan(resolved_zip, 'zip', '/vsizip/./', suffix), None
+    
+    # Handle regular file paths
+    resolved = resolve_path_aggressively(datasource, project_folder, search_roots)
+    if not resolved:
+        return None, f"File not found: {datasource}"
+    kind = 'shapefile' if os.path.splitext(resolved)[1].lower() == '.shp' else 'file'
+    return Plan(resolved, kind, '', suffix), None
+
 def get_unique_output_path(resolved_path, links_folder, copied_paths):
     """Generate a unique output path in the Links directory with minimal structure to avoid naming conflicts"""
     filename = os.path.basename(resolved_path)
     parent_dir = os.path.basename(os.path.dirname(resolved_path))
     
     # Only use parent directory if it's meaningful (not empty, ., .., or common system folders)
-    system_folders = {'Documents', 'Desktop', 'Downloads', 'Users', 'home', 'tmp', 'temp', 'Program Files', 'Windows', 'System32'}
-    
-    if parent_dir and parent_dir not in {'.', '..', ''} and parent_dir not in system_folders:
+    if parent_dir and parent_dir not in {'.', '..', ''} and parent_dir not in SYSTEM_FOLDERS:
         # Use parent_dir/filename structure within Links
         output_path = os.path.join(links_folder, parent_dir, filename)
         relative_path = f"Links/{parent_dir}/{filename}"
@@ -115,25 +225,102 @@ def get_unique_output_path(resolved_path, links_folder, copied_paths):
     
     return output_path, relative_path
 
-def copy_shapefile_sidecars(src, output_path):
-    """Copy shapefile and all associated files to the specified output path"""
-    # Ensure output directory exists
-    output_dir = os.path.dirname(output_path)
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    base_src, _ = os.path.splitext(src)
+@functools.lru_cache(maxsize=None)
+def _list_dir_files(directory):
+    """List the files in a directory once per run, by exact name and by lower-cased name"""
+    exact = {}
+    folded = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                exact[entry.name] = entry.path
+                folded.setdefault(entry.name.lower(), []).append((entry.name, entry.path))
+    return exact, folded
+
+def shapefile_sidecar_jobs(src, output_path, relative_path):
+    """List (source, destination, archive name) jobs for a shapefile and all associated files"""
+    parent, filename = os.path.split(src)
+    stem = os.path.splitext(filename)[0]
     base_out, _ = os.path.splitext(output_path)
-    copied = []
+    base_rel, _ = os.path.splitext(relative_path)
+    jobs = [(src, output_path, relative_path)]
     
-    for ext in ['.shp', '.dbf', '.shx', '.prj', '.cpg', '.qix', '.sbn', '.sbx', '.shp.xml', '.fix', '.qpj']:
-        src_file = base_src + ext
-        if os.path.isfile(src_file):
-            out_file = base_out + ext
-            shutil.copy2(src_file, out_file)
-            copied.append(os.path.basename(out_file))
+    # Sidecars come from the folder's cached listing. A case-insensitive match is only
+    # trusted when it is unambiguous and no other shapefile differs from this one by case alone.
+    exact, folded = _list_dir_files(parent)
+    case_unique = len(folded.get(filename.lower(), ())) <= 1
+    for ext in SHAPEFILE_EXTENSIONS:
+        if ext == '.shp':
+            continue
+        name = stem + ext
+        path = exact.get(name)
+        if path is None:
+            matches = folded.get(name.lower(), ())
+            if not case_unique or len(matches) != 1:
+                continue
+            name, path = matches[0]
+        # Keep the extension's case as it is on disk
+        ext = name[-len(ext):]
+        jobs.append((path, base_out + ext, base_rel + ext))
     
-    return copied
+    return jobs
+
+created_dirs = set()
+
+def ensure_dir(path):
+    """Create a directory once; later calls for the same path are a set lookup"""
+    if path not in created_dirs:
+        os.makedirs(path, exist_ok=True)
+        created_dirs.add(path)
+
+def _fast_copy(src, dst):
+    """Copy file contents in the kernel when possible; timestamps and permissions are not kept"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        copied = 0
+        
+        # copy_file_range can reflink or copy server-side; sendfile avoids the Python read loop
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except OSError:
+                pass
+        if copied < size and hasattr(os, 'sendfile'):
+            try:
+                while copied < size:
+                    sent = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except OSError:
+                pass
+        
+        # Whatever is left (other platforms, unsupported filesystems, growing files)
+        fsrc.seek(copied)
+        fdst.seek(copied)
+        shutil.copyfileobj(fsrc, fdst)
+
+def add_copy_jobs(jobs, copy_jobs, executor, pending_copies):
+    """Record package jobs and, if an executor is given, start copying them into the package folder right away"""
+    copy_jobs.extend(jobs)
+    if executor is not None:
+        pending_copies.extend(executor.submit(copy_to_package, src, dst) for src, dst, _ in jobs)
+
+def zip_compress_type(path):
+    """Pick ZIP_STORED for already-compressed files and ZIP_DEFLATED for everything else"""
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def copy_to_package(src, dst):
+    """Copy a file into the package folder, creating its directory if needed"""
+    ensure_dir(os.path.dirname(dst))
+    _fast_copy(src, dst)
 
 # --- Get current project ---
 project = QgsProject.instance()
@@ -148,151 +335,129 @@ project_name, project_ext = os.path.splitext(os.path.basename(project_path))
 output_folder = os.path.join(project_folder, f"{project_name}_packaged")
 links_folder = os.path.join(output_folder, "Links")
 
-if os.path.exists(output_folder):
-    shutil.rmtree(output_folder)
-os.makedirs(output_folder)
-os.makedirs(links_folder)
-print(f"Package directory: {output_folder}")
-print(f"Links directory: {links_folder}")
+if KEEP_PACKAGE_FOLDER:
+    if os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    ensure_dir(links_folder)
+    print(f"Package directory: {output_folder}")
+    print(f"Links directory: {links_folder}")
 
-# Search roots for finding missing files
-search_roots = [
+# Never index our own output when searching for missing files
+index_skip_dirs.add(output_folder)
+
+# Search roots for finding missing files (a tuple, as it is part of the resolution cache key)
+search_roots = (
     project_folder,
     os.path.dirname(project_folder),
     os.path.dirname(os.path.dirname(project_folder)),
     os.path.dirname(os.path.dirname(os.path.dirname(project_folder))),
-]
+)
 
-# --- Extract .qgs XML from .qgz if needed ---
+# --- Read .qgs XML from .qgz in memory if needed ---
 if project_ext.lower() == '.qgz':
     print("Processing .qgz file...")
     with zipfile.ZipFile(project_path, 'r') as zipf:
-        with zipf.open(f'{project_name}.qgs') as qgsfile:
-            xml_data = qgsfile.read()
-    qgs_path = os.path.join(tempfile.gettempdir(), f'{project_name}_tmp.qgs')
-    with open(qgs_path, 'wb') as f:
-        f.write(xml_data)
+        qgs_source = io.BytesIO(zipf.read(f'{project_name}.qgs'))
 else:
-    qgs_path = project_path
+    qgs_source = project_path
 
 # --- Parse the .qgs XML for all layers ---
 print("Processing project layers...")
-tree = ET.parse(qgs_path)
-root = tree.getroot()
 processed_count = 0
 skipped_count = 0
 copied_paths = set()
+# Resolved source -> relative path it was given in the package
+placed_sources = {}
+copy_jobs = []
 
-for maplayer in root.findall('.//maplayer'):
-    provider = maplayer.findtext('provider')
-    datasource = maplayer.findtext('datasource')
-    name = maplayer.findtext('layername') or 'unnamed'
-    
-    if not provider or not datasource:
-        print(f"Skipping layer '{name}': No datasource")
-        skipped_count += 1
-        continue
-    
-    # Handle /vsizip/ paths - copy the entire ZIP file
-    if datasource.startswith('/vsizip/'):
-        zip_path, inner_path = parse_vsizip_path(datasource)
-        if zip_path:
-            resolved_zip = resolve_path_aggressively(zip_path, project_folder)
-            if resolved_zip:
-                output_path, relative_path = get_unique_output_path(resolved_zip, links_folder, copied_paths)
-                
-                output_dir = os.path.dirname(output_path)
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                
-                if output_path not in copied_paths:
-                    shutil.copy2(resolved_zip, output_path)
-                    copied_paths.add(output_path)
-                    print(f"Copied: {relative_path}")
-                
-                # Update XML to point to the copied ZIP
-                new_datasource = f"/vsizip/./{relative_path}"
-                if inner_path:
-                    new_datasource += f"/{inner_path}"
-                if '|' in datasource:
-                    new_datasource += '|' + datasource.split('|', 1)[1]
-                
-                datasource_elem = maplayer.find('datasource')
-                if datasource_elem is not None:
-                    datasource_elem.text = new_datasource
-                processed_count += 1
-            else:
-                print(f"ZIP file not found: {zip_path}")
-                skipped_count += 1
-        else:
-            print(f"Invalid vsizip path: {datasource}")
+# Copies into the package folder (I/O-bound) run on a pool while the XML is still being walked
+copy_executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) if KEEP_PACKAGE_FOLDER else None
+pending_copies = []
+
+try:
+    # Layers are handled as soon as their end tag is parsed, in the same pass that
+    # builds the tree. Elements are not cleared: the whole project is written back.
+    context = ET.iterparse(qgs_source, events=('end',), **ITERPARSE_OPTIONS)
+    for _, maplayer in context:
+        if maplayer.tag != 'maplayer':
+            continue
+        
+        provider, datasource_elem, name = read_maplayer(maplayer)
+        datasource = datasource_elem.text if datasource_elem is not None else None
+        name = name or 'unnamed'
+        
+        if not provider or not datasource:
+            print(f"Skipping layer '{name}': No datasource")
             skipped_count += 1
-        continue
-    
-    # Handle regular file paths
-    resolved = resolve_path_aggressively(datasource, project_folder)
-    if resolved:
-        ext = os.path.splitext(resolved)[1].lower()
-        output_path, relative_path = get_unique_output_path(resolved, links_folder, copied_paths)
+            continue
         
-        if ext == '.shp':
-            files = copy_shapefile_sidecars(resolved, output_path)
-            if files:
-                datasource_elem = maplayer.find('datasource')
-                if datasource_elem is not None:
-                    new_path = relative_path
-                    if '|' in datasource:
-                        new_path += '|' + datasource.split('|', 1)[1]
-                    datasource_elem.text = new_path
-                processed_count += 1
-                copied_paths.add(output_path)
-                print(f"Copied shapefile: {relative_path}")
+        plan, reason = plan_layer(datasource, project_folder, search_roots)
+        if plan is None:
+            print(reason)
+            skipped_count += 1
+            continue
+        
+        # Sources already placed by an earlier layer are reused without copying again
+        relative_path = placed_sources.get(plan.src)
+        if relative_path is None:
+            output_path, relative_path = get_unique_output_path(plan.src, links_folder, copied_paths)
+            if plan.kind == 'shapefile':
+                jobs = shapefile_sidecar_jobs(plan.src, output_path, relative_path)
+                if not jobs:
+                    print(f"Shapefile components missing: {plan.src}")
+                    skipped_count += 1
+                    continue
             else:
-                print(f"Shapefile components missing: {resolved}")
-                skipped_count += 1
-        else:
-            if output_path not in copied_paths:
-                output_dir = os.path.dirname(output_path)
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                
-                shutil.copy2(resolved, output_path)
-                copied_paths.add(output_path)
-                print(f"Copied: {relative_path}")
+                jobs = [(plan.src, output_path, relative_path)]
             
-            datasource_elem = maplayer.find('datasource')
-            if datasource_elem is not None:
-                new_path = relative_path
-                if '|' in datasource:
-                    new_path += '|' + datasource.split('|', 1)[1]
-                datasource_elem.text = new_path
-            processed_count += 1
-    else:
-        print(f"File not found: {datasource}")
-        skipped_count += 1
+            add_copy_jobs(jobs, copy_jobs, copy_executor, pending_copies)
+            copied_paths.add(output_path)
+            placed_sources[plan.src] = relative_path
+            print(f"Copied shapefile: {relative_path}" if plan.kind == 'shapefile' else f"Copied: {relative_path}")
+        
+        # Update XML to point to the packaged file
+        datasource_elem.text = plan.prefix + relative_path + plan.suffix
+        processed_count += 1
 
-print(f"Processed: {processed_count} layers | Skipped: {skipped_count} layers")
+    print(f"Processed: {processed_count} layers | Skipped: {skipped_count} layers")
 
-# --- Save updated .qgs ---
-updated_qgs_path = os.path.join(output_folder, f'{project_name}.qgs')
-tree.write(updated_qgs_path, encoding='utf-8', xml_declaration=True)
-print(f"Project file saved: {os.path.basename(updated_qgs_path)}")
+    # --- Serialize updated .qgs ---
+    root = context.root
+    # One tostring call; with lxml the whole document is passed so its DOCTYPE is kept
+    document = root.getroottree() if hasattr(root, 'getroottree') else root
+    project_files = {f'{project_name}.qgs': ET.tostring(document, encoding='utf-8', xml_declaration=True)}
 
-# --- If original was .qgz, repackage ---
-if project_ext.lower() == '.qgz':
-    updated_qgz_path = os.path.join(output_folder, f'{project_name}.qgz')
-    with zipfile.ZipFile(updated_qgz_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        zipf.write(updated_qgs_path, os.path.basename(updated_qgs_path))
-    print(f"Project file saved: {os.path.basename(updated_qgz_path)}")
-
-# --- Zip the folder ---
-zip_path = output_folder + '.zip'
-with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-    for rootdir, dirs, files in os.walk(output_folder):
-        for file in files:
-            abs_path = os.path.join(rootdir, file)
-            rel_path = os.path.relpath(abs_path, output_folder)
-            zipf.write(abs_path, rel_path)
+    # --- If original was .qgz, repackage ---
+    if project_ext.lower() == '.qgz':
+        qgz_buffer = io.BytesIO()
+        with zipfile.ZipFile(qgz_buffer, 'w', zipfile.ZIP_DEFLATED) as qgzf:
+            qgzf.writestr(f'{project_name}.qgs', project_files[f'{project_name}.qgs'])
+        project_files[f'{project_name}.qgz'] = qgz_buffer.getvalue()
+
+    if KEEP_PACKAGE_FOLDER:
+        for file_name, data in project_files.items():
+            with open(os.path.join(output_folder, file_name), 'wb') as f:
+                f.write(data)
+
+    for file_name in project_files:
+        print(f"Project file saved: {file_name}")
+
+    # --- Write the package ZIP straight from the source files ---
+    zip_path = output_folder + '.zip'
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESSLEVEL) as zipf:
+        for src, _, arcname in copy_jobs:
+            zipf.write(src, arcname, compress_type=zip_compress_type(arcname))
+        for file_name, data in project_files.items():
+            zipf.writestr(file_name, data, compress_type=zip_compress_type(file_name))
+
+    # Surface any failed copy before reporting success
+    for copy in pending_copies:
+        copy.result()
+finally:
+    # Never leave pool threads behind in the long-lived QGIS console, even on errors
+    if copy_executor is not None:
+        copy_executor.shutdown()
 
 print(f"Package created: {os.path.basename(zip_path)}")
-print(f"Output directory: {output_folder}") 
\ No newline at end of file
+if KEEP_PACKAGE_FOLDER:
+    print(f"Output directory: {output_folder}")